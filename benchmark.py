@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Run without a window: must be set before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+import Game
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+CANVAS_WIDTH = Game.WIDTH - 100
+CANVAS_HEIGHT = Game.HEIGHT - 100
+COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (0, 0, 0)]
+
+
+# Seeded synthetic scenes: lines, rectangles, rounded rectangles and nested
+# groups in roughly equal shares, scattered over the canvas
+class SceneGenerator:
+    def __init__(self, seed=0, group_size=8, max_depth=3):
+        self.random = random.Random(seed)
+        self.group_size = group_size
+        self.max_depth = max_depth
+
+    def point(self):
+        return (
+            self.random.randrange(CANVAS_WIDTH),
+            self.random.randrange(CANVAS_HEIGHT),
+        )
+
+    def near(self, pos):
+        return (
+            pos[0] + self.random.randint(-60, 60),
+            pos[1] + self.random.randint(-60, 60),
+        )
+
+    def shape(self, app):
+        start = self.point()
+        color = self.random.choice(COLORS)
+        kind = self.random.randrange(3)
+        if kind == 0:
+            return app.make_line(start, self.near(start), color)
+        rounded = kind == 2
+        radius = self.random.randint(5, 20) if rounded else 0
+        return app.make_rect(start, self.near(start), color, rounded, radius)
+
+    def group(self, app, depth, budget):
+        # A group of up to budget shapes, nesting further groups inside
+        group = Game.GroupedObject()
+        remaining = budget
+        while remaining > 0:
+            if depth < self.max_depth and remaining > 2 and self.random.random() < 0.3:
+                size = self.random.randint(2, remaining)
+                obj = self.group(app, depth + 1, size)
+            else:
+                size = 1
+                obj = self.shape(app)
+            group.add_object(obj)
+            remaining -= size
+        return group
+
+    def scene(self, app, count):
+        # Top-level objects holding count shapes in total
+        objects = []
+        remaining = count
+        while remaining > 0:
+            if remaining > 2 and self.random.random() < 0.25:
+                size = min(remaining, self.random.randint(2, self.group_size))
+                objects.append(self.group(app, 1, size))
+            else:
+                size = 1
+                objects.append(self.shape(app))
+            remaining -= size
+        return objects
+
+
+def best_time(function, repeat):
+    # Best of repeat runs, in seconds, plus every run for spread
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return min(runs), runs
+
+
+def scene_group(objects):
+    # Everything in the scene as one group, so copy and move scale with size
+    group = Game.GroupedObject()
+    for obj in objects:
+        group.add_object(obj)
+    return group
+
+
+def bench_size(size, args, work_dir):
+    generator = SceneGenerator(args.seed)
+    app = Game.DrawingApp(frame_cap=0)
+    app.history = None  # Benchmarks measure the edit paths, not undo history
+    objects = generator.scene(app, size)
+    app.add_objects(objects)
+    results = []
+
+    def record(op, function, repeat=args.repeat, per_call=1):
+        seconds, runs = best_time(function, repeat)
+        results.append(
+            {
+                "size": size,
+                "objects": len(app.objects),
+                "op": op,
+                "seconds": seconds / per_call,
+                "runs": [run / per_call for run in runs],
+            }
+        )
+        print(f"{size:>8} {op:<24} {seconds / per_call * 1e3:10.3f} ms", flush=True)
+
+    for extension in (".txt", Game.BINARY_EXTENSION):
+        path = os.path.join(work_dir, f"scene{size}{extension}")
+        record(f"save_drawing[{extension}]", lambda: app.save_drawing(path))
+
+        def reopen():
+            app.clear_objects()
+            app.open_drawing(path)
+
+        record(f"open_drawing[{extension}]", reopen)
+
+    xml_path = os.path.join(work_dir, f"scene{size}.xml")
+    record("export_to_xml", lambda: app.export_to_xml(xml_path))
+
+    clicks = [generator.point() for _ in range(args.clicks)]
+
+    def click():
+        for pos in clicks:
+            app.get_selected_object(pos)
+
+    record("get_selected_object", click, per_call=len(clicks))
+
+    def frame():
+        app.full_redraw = True
+        app.render()
+
+    record("render_frame", frame)
+
+    # Dragging an object to be moved: each frame draws it where the mouse is
+    # over the canvas, which is kept as it was
+    app.toolbar.selected_object = next(iter(app.objects))
+    app.toolbar.selected_tool = Game.MOVE_OBJ2
+    app.render()
+
+    def drag():
+        for pos in clicks:
+            app.pointer = pos
+            app.render()
+
+    record("drag_frame", drag, per_call=len(clicks))
+    app.toolbar.selected_tool = None
+
+    # Last, as moving the group leaves the spatial index out of date
+    group = scene_group(app.objects)
+
+    def cold_copy():
+        # The first copy of a group builds the contents its copies share
+        group.paste_definition = None
+        app.copy_object(group)
+
+    record("copy_object[cold]", cold_copy)
+    record("copy_object[cached]", lambda: app.copy_object(group))
+    positions = [generator.point() for _ in range(args.repeat)]
+    record("GroupedObject.move", lambda: group.move(positions.pop()))
+    return results
+
+
+def bench_memory(size, args):
+    # Bytes per shape from tracemalloc: the shapes themselves (as objects, or as
+    # SceneStore rows plus their views), then what the scene and index add
+    results = []
+
+    def record(op, total):
+        results.append({"size": size, "op": op, "bytes_per_shape": total / size})
+        print(f"{size:>8} {op:<24} {total / size:10.1f} B/shape", flush=True)
+
+    for columnar in (False, True):
+        generator = SceneGenerator(args.seed)
+        app = Game.DrawingApp(frame_cap=0, columnar=columnar)
+        app.history = None
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        objects = generator.scene(app, size)
+        built = tracemalloc.get_traced_memory()[0]
+        app.add_objects(objects)
+        in_scene = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        if columnar:
+            store = app.store
+            capacity = sum(
+                getattr(store, name).nbytes
+                for name in ("coords", "colors", "kinds", "rounded", "radii", "groups")
+            )
+            record("memory[store rows]", store.nbytes())
+            record("memory[views]", built - start - capacity)
+            record("memory[scene, columnar]", in_scene - built)
+        else:
+            record("memory[objects]", built - start)
+            record("memory[scene, objects]", in_scene - built)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless DrawingApp benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--clicks", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--memory-only", action="store_true", help="skip the timings")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="drawing-bench-")
+    try:
+        results = []
+        memory = []
+        for size in args.sizes:
+            if not args.memory_only:
+                results.extend(bench_size(size, args, work_dir))
+            memory.extend(bench_memory(size, args))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "python": sys.version.split()[0],
+        "pygame": pygame.version.ver,
+        "numpy": Game.np.__version__ if Game.np is not None else None,
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": results,
+        "memory": memory,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("Results written to", args.output)
+
+
+if __name__ == "__main__":
+    main()
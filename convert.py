@@ -0,0 +1,235 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Run without a window: must be set before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import Game
+
+FORMATS = {"xml": Game.XML_EXTENSION, "png": Game.PNG_EXTENSION}
+MANIFEST_NAME = ".convert-manifest.json"  # Output path -> hash of what made it
+HASH_BLOCK = 1 << 20
+
+app = None  # Each worker process loads and exports through one DrawingApp
+
+
+def init_worker():
+    global app
+    app = Game.DrawingApp(frame_cap=0)
+    app.history = None
+
+
+def input_hash(source, scale):
+    # Content hash of a drawing plus the options that shape its outputs
+    digest = hashlib.sha256(f"scale={scale}\n".encode())
+    with open(source, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_drawings(paths, recursive):
+    # (drawing, its path relative to the input it was found under), for each
+    # file named and each .txt drawing in a directory named
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path, os.path.basename(path)
+            continue
+        if recursive:
+            walk = os.walk(path)
+        else:
+            walk = [(path, [], os.listdir(path))]
+        for folder, _, names in walk:
+            for name in sorted(names):
+                source = os.path.join(folder, name)
+                if name.endswith(".txt") and os.path.isfile(source):
+                    yield source, os.path.relpath(source, path)
+
+
+def output_paths(source, relative, formats, out_dir):
+    # format -> output file, beside the drawing or mirrored under out_dir
+    if out_dir is None:
+        stem = os.path.splitext(source)[0]
+    else:
+        stem = os.path.join(out_dir, os.path.splitext(relative)[0])
+    outputs = {fmt: stem + FORMATS[fmt] for fmt in formats}
+    # Never write over the drawing being read
+    return {
+        fmt: path
+        for fmt, path in outputs.items()
+        if os.path.abspath(path) != os.path.abspath(source)
+    }
+
+
+def is_current(source, path, check, digest, made_from):
+    if not os.path.exists(path):
+        return False
+    if check == "hash":
+        return made_from == digest
+    return os.path.getmtime(path) >= os.path.getmtime(source)
+
+
+def convert_file(source, outputs, check, made_from, scale, force):
+    # Runs in a worker: write each output that is not up to date. made_from
+    # maps output paths to the input hash recorded when they were written
+    start = time.perf_counter()
+    result = {
+        "source": source,
+        "bytes": os.path.getsize(source),
+        "shapes": 0,
+        "converted": [],
+        "skipped": [],
+        "digest": None,
+        "error": None,
+    }
+    try:
+        if check == "hash":
+            result["digest"] = input_hash(source, scale)
+        stale = {}
+        for fmt, path in outputs.items():
+            if not force and is_current(
+                source, path, check, result["digest"], made_from.get(path)
+            ):
+                result["skipped"].append(fmt)
+            else:
+                stale[fmt] = path
+        if stale:
+            objects = app.read_drawing(source, parallel=False)
+            result["shapes"] = sum(Game.shape_count(obj) for obj in objects)
+            for fmt, path in stale.items():
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                # Written beside the output and moved over it, so an
+                # interrupted run leaves no half file that looks up to date.
+                # pygame picks the image format from the extension
+                stem, extension = os.path.splitext(path)
+                part_path = stem + ".part" + extension
+                try:
+                    if fmt == "png":
+                        app.export_to_png(part_path, objects, scale)
+                    else:
+                        app.export_to_xml(part_path, objects)
+                    os.replace(part_path, path)
+                finally:
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                result["converted"].append(fmt)
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def describe(result):
+    # One report line: what was done with a drawing and how fast
+    source = result["source"]
+    if result["error"] is not None:
+        return f"{source}: failed ({result['error']})"
+    if not result["converted"]:
+        return f"{source}: up to date"
+    seconds = max(result["seconds"], 1e-9)
+    megabytes = result["bytes"] / 1e6
+    return (
+        f"{source} -> {', '.join(result['converted'])}: "
+        f"{result['shapes']} shapes, {megabytes:.2f} MB in {seconds:.3f} s "
+        f"({megabytes / seconds:.2f} MB/s, {result['shapes'] / seconds:.0f} shapes/s)"
+    )
+
+
+def load_manifest(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".part", "w") as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(path + ".part", path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert text drawings to XML and PNG without a window"
+    )
+    parser.add_argument("inputs", nargs="+", help="drawings, or directories of .txt")
+    parser.add_argument("--to", nargs="+", choices=sorted(FORMATS), default=["xml"])
+    parser.add_argument("--out", help="output directory (default: beside each drawing)")
+    parser.add_argument("--recursive", action="store_true")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--check",
+        choices=("mtime", "hash"),
+        default="mtime",
+        help="how outputs are found up to date: newer than the drawing, or "
+        "made from the same content (recorded in " + MANIFEST_NAME + ")",
+    )
+    parser.add_argument("--force", action="store_true", help="convert everything")
+    parser.add_argument("--scale", type=float, default=1.0, help="PNG scale")
+    parser.add_argument("--report", help="also write the per-file results as JSON")
+    args = parser.parse_args()
+
+    manifest_path = os.path.join(args.out or ".", MANIFEST_NAME)
+    manifest = load_manifest(manifest_path) if args.check == "hash" else {}
+    jobs = []
+    for source, relative in find_drawings(args.inputs, args.recursive):
+        outputs = output_paths(source, relative, args.to, args.out)
+        made_from = {
+            path: manifest.get(os.path.abspath(path)) for path in outputs.values()
+        }
+        jobs.append((source, outputs, made_from))
+    # Biggest first, so one large drawing does not finish the run on its own
+    jobs.sort(key=lambda job: os.path.getsize(job[0]), reverse=True)
+
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max(1, args.jobs), initializer=init_worker) as pool:
+        futures = {
+            pool.submit(
+                convert_file,
+                source,
+                outputs,
+                args.check,
+                made_from,
+                args.scale,
+                args.force,
+            ): outputs
+            for source, outputs, made_from in jobs
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(describe(result), flush=True)
+            if result["digest"] is not None:
+                outputs = futures[future]
+                for fmt in result["converted"] + result["skipped"]:
+                    manifest[os.path.abspath(outputs[fmt])] = result["digest"]
+    elapsed = time.perf_counter() - start
+    if args.check == "hash":
+        save_manifest(manifest_path, manifest)
+
+    converted = [result for result in results if result["converted"]]
+    failed = [result for result in results if result["error"] is not None]
+    megabytes = sum(result["bytes"] for result in converted) / 1e6
+    shapes = sum(result["shapes"] for result in converted)
+    print(
+        f"{len(converted)} converted, {len(results) - len(converted) - len(failed)} "
+        f"up to date, {len(failed)} failed; {megabytes:.2f} MB, {shapes} shapes "
+        f"in {elapsed:.2f} s ({megabytes / max(elapsed, 1e-9):.2f} MB/s)"
+    )
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump({"seconds": elapsed, "results": results}, file, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+import argparse
+import hashlib
+import http.server
+import io
+import os
+import signal
+import socketserver
+import sys
+import threading
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# Run without a window: must be set before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+import Game
+
+MIN_SIDE = 16  # Limits on a requested image width or height
+MAX_SIDE = 8192
+HASH_BLOCK = 1 << 20
+WORKER_DRAWINGS = 4  # Parsed drawings each worker keeps for other sizes
+RENDER_VERSION = 1  # Part of every cache key: bump when rendering changes
+
+app = None  # Each worker process loads and draws through one DrawingApp
+drawings = OrderedDict()  # In a worker: content hash -> top-level objects
+
+
+def init_worker():
+    global app
+    app = Game.DrawingApp(frame_cap=0)
+    app.history = None
+
+
+def render_png(path, digest, size, scale):
+    # Runs in a worker: the PNG bytes of a drawing. The drawing is parsed
+    # once for several renders at different sizes
+    objects = drawings.pop(digest, None)
+    if objects is None:
+        objects = app.read_drawing(path, parallel=False)
+    drawings[digest] = objects
+    while len(drawings) > WORKER_DRAWINGS:
+        drawings.popitem(last=False)
+    surface = app.render_image(objects, scale, size, MAX_SIDE)
+    buffer = io.BytesIO()
+    pygame.image.save(surface, buffer, "png")
+    return buffer.getvalue()
+
+
+# Rendered PNGs on disk, one file per cache key; past max_bytes the least
+# recently used are deleted. Use order survives restarts through the files'
+# modification times
+class PngCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> size, least recently used first
+        self.size = 0
+        os.makedirs(directory, exist_ok=True)
+        found = []
+        for name in os.listdir(directory):
+            if name.endswith(Game.PNG_EXTENSION) and not name.startswith("."):
+                stat = os.stat(os.path.join(directory, name))
+                found.append(
+                    (stat.st_mtime, name[: -len(Game.PNG_EXTENSION)], stat.st_size)
+                )
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.size += size
+        self.evict()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + Game.PNG_EXTENSION)
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(self.path(key), "rb") as file:
+                data = file.read()
+            os.utime(self.path(key))
+        except OSError:
+            # Deleted behind our back
+            with self.lock:
+                self.size -= self.entries.pop(key, 0)
+            return None
+        return data
+
+    def put(self, key, data):
+        # Written under a temporary name and moved in, so a reader never
+        # sees half a file
+        part_path = os.path.join(self.directory, f".{key}.{threading.get_ident()}")
+        with open(part_path, "wb") as file:
+            file.write(data)
+        os.replace(part_path, self.path(key))
+        with self.lock:
+            self.size += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self.evict()
+
+    def evict(self):
+        # Called with the lock held (or before any thread has it)
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+
+# Answers render requests from the cache, or from a pool of worker
+# processes. Requests for the same image while it is being drawn wait for
+# that render instead of starting another
+class RenderService:
+    def __init__(self, root, cache, jobs):
+        self.root = os.path.realpath(root)
+        self.cache = cache
+        self.pool = ProcessPoolExecutor(jobs, initializer=init_worker)
+        self.lock = threading.Lock()
+        self.pending = {}  # key -> Future of the render in progress
+        self.hashes = {}  # path -> ((mtime, size), content hash)
+
+    def resolve(self, name):
+        # The drawing file a request names, which must lie under root
+        path = os.path.realpath(os.path.join(self.root, name))
+        if os.path.commonpath((self.root, path)) != self.root:
+            raise PermissionError(name)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(name)
+        return path
+
+    def content_hash(self, path):
+        # Rehashed only when the file's modification time or size changes
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            known = self.hashes.get(path)
+        if known is not None and known[0] == version:
+            return known[1]
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(HASH_BLOCK), b""):
+                digest.update(block)
+        digest = digest.hexdigest()
+        with self.lock:
+            self.hashes[path] = (version, digest)
+        return digest
+
+    def key(self, path, size, scale):
+        # The cache key: what is drawn and how
+        digest = self.content_hash(path)
+        # The extension picks the loader, so the same bytes may draw differently
+        extension = os.path.splitext(path)[1]
+        params = f"{RENDER_VERSION} {extension} {size} {scale}"
+        return digest, hashlib.sha256(f"{digest} {params}".encode()).hexdigest()
+
+    def render(self, path, digest, key, size, scale):
+        # PNG bytes, and whether they came from the cache
+        data = self.cache.get(key)
+        if data is not None:
+            return data, True
+        with self.lock:
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pool.submit(render_png, path, digest, size, scale)
+                self.pending[key] = future
+        if not owner:
+            return future.result(), False
+        try:
+            data = future.result()
+            self.cache.put(key, data)
+        finally:
+            with self.lock:
+                del self.pending[key]
+        return data, False
+
+
+class RenderHandler(http.server.BaseHTTPRequestHandler):
+    # GET /render?file=<path under root>&width=<px>&height=<px>&scale=<zoom>
+    # width and height fit the drawing inside that size (either may be left
+    # out); without them it is drawn at scale, cropped to its extent
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/render":
+            self.send_error(404, "Only /render is served")
+            return
+        query = urllib.parse.parse_qs(url.query)
+        service = self.server.service
+        try:
+            name = query["file"][0]
+            width = self.side(query, "width")
+            height = self.side(query, "height")
+            scale = float(query.get("scale", ["1"])[0])
+            if not 0 < scale <= Game.MAX_ZOOM:
+                raise ValueError("scale out of range")
+        except (KeyError, ValueError) as error:
+            self.send_error(400, f"Bad request: {error}")
+            return
+        size = None if width is None and height is None else (width, height)
+        if size is not None:
+            scale = 1
+        try:
+            path = service.resolve(name)
+            digest, key = service.key(path, size, scale)
+        except PermissionError:
+            self.send_error(403, "Outside the drawing directory")
+            return
+        except FileNotFoundError:
+            self.send_error(404, "No such drawing")
+            return
+        etag = f'"{key}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        try:
+            data, hit = service.render(path, digest, key, size, scale)
+        except Exception as error:
+            self.send_error(500, f"Render failed: {type(error).__name__}: {error}")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("X-Cache", "hit" if hit else "miss")
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def side(query, name):
+        if name not in query:
+            return None
+        value = int(query[name][0])
+        if not MIN_SIDE <= value <= MAX_SIDE:
+            raise ValueError(f"{name} must be {MIN_SIDE} to {MAX_SIDE}")
+        return value
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if self.client_address else "unix socket"
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def stop(signum, frame):
+    # pygame leaves SIGTERM to SDL, which only queues a quit event no one
+    # reads here: stop the way Ctrl+C does
+    raise KeyboardInterrupt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve drawings as PNG over HTTP")
+    parser.add_argument("--root", default=".", help="directory drawings are read from")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--socket", help="listen on this Unix socket instead")
+    parser.add_argument("--cache", default=".render-cache", help="PNG cache directory")
+    parser.add_argument("--cache-mb", type=float, default=256)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    cache = PngCache(args.cache, int(args.cache_mb * 1024 * 1024))
+    service = RenderService(args.root, cache, max(1, args.jobs))
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, RenderHandler)
+        where = args.socket
+    else:
+        server = http.server.ThreadingHTTPServer((args.host, args.port), RenderHandler)
+        where = f"http://{args.host}:{server.server_address[1]}/render?file=..."
+    server.service = service
+    signal.signal(signal.SIGTERM, stop)
+    print("Serving", where, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.pool.shutdown(cancel_futures=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import os
+
+# Run without a window: must be set before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import Game
+from benchmark import SceneGenerator
+
+
+def describe(obj, dx=0, dy=0):
+    # What an object draws: its shapes where they land, nested as grouped
+    if isinstance(obj, Game.GroupedObject):
+        dx, dy = dx + obj.offset[0], dy + obj.offset[1]
+        return ("group", [describe(sub_obj, dx, dy) for sub_obj in obj.objects])
+    start = (obj.start_pos[0] + dx, obj.start_pos[1] + dy)
+    end = (obj.end_pos[0] + dx, obj.end_pos[1] + dy)
+    if isinstance(obj, Game.Rectangle):
+        return ("rect", start, end, obj.color, obj.rounded, obj.radius)
+    return ("line", start, end, obj.color)
+
+
+def sample_drawing():
+    # Shapes and nested groups, plus moved groups and pasted copies, which are
+    # saved as instances of a shared definition
+    app = Game.DrawingApp(frame_cap=0)
+    generator = SceneGenerator(2)
+    for obj in generator.scene(app, 400):
+        app.create_object(obj)
+    groups = [obj for obj in app.objects if isinstance(obj, Game.GroupedObject)]
+    for group in groups[:5]:
+        app.move_object(group, generator.point())
+        app.paste_object(group, generator.point())
+        app.paste_object(group, generator.point())
+    return app
+
+
+def test_round_trips(tmp_path):
+    app = sample_drawing()
+    expected = [describe(obj) for obj in app.objects]
+    for extension in (".txt", Game.BINARY_EXTENSION):
+        path = str(tmp_path / ("drawing" + extension))
+        app.save_drawing(path)
+        for columnar in (False, True):
+            reader = Game.DrawingApp(frame_cap=0, columnar=columnar)
+            loaded = reader.read_drawing(path, parallel=False)
+            assert [describe(obj) for obj in loaded] == expected
+
+
+def test_parallel_load_matches_serial(tmp_path, monkeypatch):
+    app = sample_drawing()
+    path = str(tmp_path / "drawing.txt")
+    app.save_drawing(path)
+    serial = [describe(obj) for obj in app.read_drawing(path, parallel=False)]
+    # Spans cover the file, and each parses on its own
+    size = os.path.getsize(path)
+    for chunks in (1, 7, 50, 1000):
+        spans = Game.split_drawing(path, chunks)
+        assert spans[0][0] == 0 and spans[-1][1] == size
+        assert all(a[1] == b[0] for a, b in zip(spans, spans[1:]))
+        for span in spans:
+            Game.parse_chunk(path, span)
+    # Small chunks, so instances often come in a later chunk than the
+    # definition they share
+    monkeypatch.setattr(Game, "LOAD_CHUNKS_PER_WORKER", 25)
+    parallel = app.read_drawing_parallel(path, workers=2)
+    assert [describe(obj) for obj in parallel] == serial
+
+
+def as_xml_keeps_it(description):
+    # XML has no radius, and colors other than its four names load as unknown
+    if description[0] == "group":
+        return ("group", [as_xml_keeps_it(sub) for sub in description[1]])
+    color = description[3]
+    if color not in Game.XML_COLORS.values():
+        color = Game.UNKNOWN_COLOR
+    if description[0] == "rect":
+        return description[:3] + (color, description[4], 0)
+    return description[:3] + (color,)
+
+
+def test_xml_round_trip(tmp_path):
+    app = sample_drawing()
+    app.create_object(app.make_line((5, 6), (70, 80), (1, 2, 3)))
+    expected = [as_xml_keeps_it(describe(obj)) for obj in app.objects]
+    path = str(tmp_path / ("drawing" + Game.XML_EXTENSION))
+    app.export_to_xml(path)
+    for columnar in (False, True):
+        reader = Game.DrawingApp(frame_cap=0, columnar=columnar)
+        loaded = reader.read_drawing(path)
+        assert [describe(obj) for obj in loaded] == expected
+
+
+def test_binary_reads_without_numpy(tmp_path, monkeypatch):
+    app = sample_drawing()
+    path = str(tmp_path / ("drawing" + Game.BINARY_EXTENSION))
+    app.save_drawing(path)
+    monkeypatch.setattr(Game, "np", None)
+    loaded = Game.DrawingApp(frame_cap=0).read_drawing(path)
+    assert [describe(obj) for obj in loaded] == [describe(obj) for obj in app.objects]
+
+
+def test_binary_keeps_wide_radius(tmp_path):
+    app = Game.DrawingApp(frame_cap=0)
+    app.create_object(app.make_rect((0, 0), (100000, 90000), (1, 2, 3), True, 40000))
+    path = str(tmp_path / ("wide" + Game.BINARY_EXTENSION))
+    app.save_drawing(path)
+    for reader in (app, Game.DrawingApp(frame_cap=0, columnar=True)):
+        (rect,) = reader.read_drawing(path)
+        assert (rect.rounded, rect.radius) == (True, 40000)
@@ -0,0 +1,67 @@
+import os
+
+# Run without a window: must be set before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import Game
+
+
+def leaf_positions(app):
+    # Where each shape is drawn, with the offsets of its groups applied
+    positions = []
+
+    def walk(obj, dx, dy):
+        if isinstance(obj, Game.GroupedObject):
+            for sub_obj in obj.objects:
+                walk(sub_obj, dx + obj.offset[0], dy + obj.offset[1])
+        else:
+            positions.append(
+                (
+                    (obj.start_pos[0] + dx, obj.start_pos[1] + dy),
+                    (obj.end_pos[0] + dx, obj.end_pos[1] + dy),
+                )
+            )
+
+    for obj in app.objects:
+        walk(obj, 0, 0)
+    return positions
+
+
+def test_undo_ungroup_of_moved_group():
+    app = Game.DrawingApp(frame_cap=0)
+    rect = app.make_rect((100, 100), (150, 130), (255, 0, 0), False, 0)
+    line = app.make_line((120, 140), (200, 140), (0, 0, 255))
+    app.create_object(rect)
+    app.create_object(line)
+    before = leaf_positions(app)
+
+    group = app.group_objects([rect, line])
+    app.move_object(group, (300, 300))
+    app.ungroup_object(group)
+    after = leaf_positions(app)
+    assert after == [((300, 300), (350, 330)), ((320, 340), (400, 340))]
+
+    for _ in range(3):
+        app.undo()
+    assert list(app.objects) == [rect, line]
+    assert leaf_positions(app) == before
+
+    for _ in range(3):
+        app.redo()
+    assert list(app.objects) == [rect, line]
+    assert leaf_positions(app) == after
+    # Clicks still find the shapes where they are drawn
+    assert app.get_selected_object((300, 315)) is rect
+
+
+def test_paste_keeps_square_corners():
+    app = Game.DrawingApp(frame_cap=0)
+    square = app.make_rect((10, 10), (40, 40), (0, 0, 0), False, 0)
+    rounded = app.make_rect((50, 10), (90, 40), (0, 0, 0), True, 8)
+    app.create_object(square)
+    app.create_object(rounded)
+    group = app.group_objects([square, rounded])
+    pasted = app.paste_object(group, (200, 200))
+    corners = [(obj.rounded, obj.radius) for obj in pasted.objects]
+    assert corners == [(False, 0), (True, 8)]
@@ -0,0 +1,85 @@
+import os
+import random
+
+# Run without a window: must be set before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import Game
+from benchmark import SceneGenerator
+from test_files import describe
+
+
+def edit(app, generator, rnd, count):
+    # Random journaled edits, undo included
+    for _ in range(count):
+        objects = list(app.objects)
+        obj = rnd.choice(objects)
+        action = rnd.randrange(9)
+        if action == 0:
+            app.move_object(obj, generator.point())
+        elif action == 1:
+            app.recolor_object(obj, rnd.choice([(255, 0, 0), (0, 0, 255)]))
+        elif action == 2 and isinstance(obj, Game.Rectangle):
+            app.set_object_radius(obj, True, rnd.randint(1, 30))
+        elif action == 3:
+            app.group_objects(rnd.sample(objects, min(4, len(objects))))
+        elif action == 4 and isinstance(obj, Game.GroupedObject):
+            app.ungroup_object(obj)
+        elif action == 5:
+            app.delete_objects(rnd.sample(objects, min(2, len(objects) - 1)))
+        elif action == 6:
+            app.paste_object(obj, generator.point())
+        elif action == 7:
+            app.create_object(generator.shape(app))
+        else:
+            app.undo()
+
+
+def start_session(tmp_path, seed):
+    app = Game.DrawingApp(frame_cap=0, session_path=str(tmp_path / "session"))
+    generator = SceneGenerator(seed)
+    rnd = random.Random(seed)
+    for obj in generator.scene(app, 60):
+        app.create_object(obj)
+    edit(app, generator, rnd, 40)
+    return app, generator, rnd
+
+
+def replayed(tmp_path):
+    app = Game.DrawingApp(frame_cap=0, session_path=str(tmp_path / "session"))
+    return [describe(obj) for obj in app.objects]
+
+
+def test_replay_after_compaction(tmp_path):
+    app, generator, rnd = start_session(tmp_path, 3)
+    app.journal.compact(app)
+    # Undo now puts back objects deleted before the compaction
+    edit(app, generator, rnd, 40)
+    for _ in range(20):
+        app.undo()
+    app.journal.flush()
+    assert replayed(tmp_path) == [describe(obj) for obj in app.objects]
+
+
+def test_replay_during_background_compaction(tmp_path):
+    app, generator, rnd = start_session(tmp_path, 4)
+    app.journal.compact_in_background(app)
+    edit(app, generator, rnd, 40)
+    app.journal.task.thread.join()
+    app.journal.flush()  # The session ends before the snapshot is installed
+    assert os.path.exists(app.journal.next_path)
+    assert replayed(tmp_path) == [describe(obj) for obj in app.objects]
+
+
+def test_replay_after_background_compaction(tmp_path):
+    app, generator, rnd = start_session(tmp_path, 5)
+    app.journal.compact_in_background(app)
+    edit(app, generator, rnd, 20)
+    app.journal.install_compaction(app, wait=True)
+    edit(app, generator, rnd, 20)
+    for _ in range(20):
+        app.undo()
+    app.journal.flush()
+    assert not os.path.exists(app.journal.next_path)
+    assert replayed(tmp_path) == [describe(obj) for obj in app.objects]
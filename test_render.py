@@ -0,0 +1,40 @@
+import os
+import random
+
+# Run without a window: must be set before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+import Game
+from benchmark import SceneGenerator
+
+
+def canvas_bytes(app):
+    return pygame.image.tobytes(app.canvas, "RGB")
+
+
+def test_pan_matches_full_redraw():
+    rnd = random.Random(1)
+    for zoom in (1, 2, 0.75):
+        app = Game.DrawingApp(frame_cap=0)
+        app.add_objects(SceneGenerator(3).scene(app, 1000))
+        app.zoom_view((400, 300), zoom)
+        app.render()
+        for _ in range(8):
+            app.pan_view(rnd.randint(-200, 200), rnd.randint(-200, 200))
+            app.render()
+            panned = canvas_bytes(app)
+            app.full_redraw = True
+            app.render()
+            assert panned == canvas_bytes(app)
+
+
+def test_fitted_image_side_is_capped():
+    app = Game.DrawingApp(frame_cap=0)
+    long_line = app.make_line((0, 0), (2_000_000, 10), (0, 0, 0))
+    for size in ((None, 64), (64, None), None):
+        width, height = app.render_image([long_line], 1, size, 4096).get_size()
+        assert max(width, height) <= 4096
+    assert app.render_image([long_line], 1, (None, 64), 4096).get_size() == (4096, 64)
@@ -0,0 +1,153 @@
+import os
+import random
+
+# Run without a window: must be set before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import Game
+from benchmark import SceneGenerator
+
+
+def check_index(app):
+    # Every top-level object is indexed under its z label and current box
+    index = app.index
+    labels = app.objects.labels
+    assert set(index.entries) == set(labels)
+    for obj, (z, bbox, keys) in index.entries.items():
+        assert z == labels[obj]
+        assert index.by_z[z] is obj
+        assert bbox == obj.get_bounding_box()
+        if keys is None:
+            assert z in index.large
+        else:
+            assert keys == index.cell_keys(bbox)
+            for key in keys:
+                assert z in index.cells[key]
+    assert sum(map(len, index.cells.values())) == sum(
+        len(keys) for z, bbox, keys in index.entries.values() if keys
+    )
+
+
+def test_index_follows_edits():
+    app = Game.DrawingApp(frame_cap=0)
+    generator = SceneGenerator(1)
+    for obj in generator.scene(app, 300):
+        app.create_object(obj)
+    check_index(app)
+
+    rnd = random.Random(1)
+    for _ in range(40):
+        objects = list(app.objects)
+        obj = rnd.choice(objects)
+        action = rnd.randrange(6)
+        if action == 0:
+            app.move_object(obj, generator.point())
+        elif action == 1:
+            app.group_objects(rnd.sample(objects, 5))
+        elif action == 2 and isinstance(obj, Game.GroupedObject):
+            app.ungroup_object(obj)
+        elif action == 3:
+            app.delete_objects(rnd.sample(objects, 3))
+        elif action == 4:
+            app.paste_object(obj, generator.point())
+        else:
+            app.undo()
+        check_index(app)
+    while app.history.undo_stack:
+        app.undo()
+        check_index(app)
+
+
+def test_hit_table_matches_point_hits():
+    app = Game.DrawingApp(frame_cap=0)
+    objects = SceneGenerator(2).scene(app, 200)
+    objects += [
+        app.make_line((50, 50), (50, 50), (0, 0, 0)),  # A point
+        app.make_rect((90, 90), (40, 60), (0, 0, 0), False, 0),  # Drawn backwards
+        Game.GroupedObject(),  # Empty, so never hit
+    ]
+    store = Game.SceneStore()  # Views read their coordinates from rows
+    objects += [
+        store.add_line((10, 300), (200, 321), (0, 0, 0)),
+        store.add_rect((300, 400), (380, 350), (0, 0, 0)),
+    ]
+    table = Game.HitTable(objects)
+    rnd = random.Random(2)
+    points = [(rnd.randrange(-20, 1240), rnd.randrange(-20, 740)) for _ in range(500)]
+    # Points on and next to the shapes' corners, where rounding would show
+    for obj in objects[:100] + objects[-5:]:
+        if not isinstance(obj, Game.GroupedObject):
+            for x, y in (obj.start_pos, obj.end_pos):
+                points += [
+                    (x + dx, y + dy) for dx in (-3, -1, 0, 1) for dy in (-1, 0, 3)
+                ]
+    for tolerance in (0, 2.5, Game.HIT_TOLERANCE):
+        for pos in points:
+            expected = [
+                obj for obj in reversed(objects) if Game.point_hits(obj, pos, tolerance)
+            ]
+            assert table.hits(pos, tolerance) == expected
+
+
+def check_order(scene, expected):
+    # Bottom to top as expected, with labels rising the same way
+    assert list(scene) == expected
+    assert len(scene) == len(expected)
+    labels = [scene.z(obj) for obj in expected]
+    assert labels == sorted(set(labels))
+    assert scene.bottom is (expected[0] if expected else None)
+    assert scene.top is (expected[-1] if expected else None)
+    for obj in expected:
+        assert scene.get(obj.scene_id) is obj
+
+
+def test_scene_order_and_relabel():
+    app = Game.DrawingApp(frame_cap=0)
+    shapes = [app.make_line((i, 0), (i, 9), (0, 0, 0)) for i in range(600)]
+    scene = Game.Scene(shapes[:50])
+    expected = shapes[:50]
+    unused = shapes[50:]
+    crowded = expected[10]
+
+    def insert(below):
+        obj = unused.pop()
+        before = dict(scene.labels)
+        moved = scene.insert(obj, below)
+        expected.insert(0 if below is None else expected.index(below) + 1, obj)
+        # Exactly the objects said to have moved got new labels
+        assert set(moved) == {
+            other for other, z in before.items() if scene.labels[other] != z
+        }
+        check_order(scene, expected)
+
+    # Inserting over one object again and again runs out of labels there,
+    # so longer and longer stretches around it are spread out
+    for _ in range(150):
+        insert(crowded)
+    rnd = random.Random(3)
+    for _ in range(1000):
+        action = rnd.randrange(4)
+        others = [obj for obj in expected if obj is not crowded]
+        if action == 0 and unused:
+            insert(rnd.choice(expected + [None]))
+        elif action == 1 and unused:
+            insert(crowded)
+        elif action == 2 and others:
+            obj = rnd.choice(others)
+            index = expected.index(obj)
+            assert scene.remove(obj) is (expected[index - 1] if index else None)
+            expected.remove(obj)
+            unused.append(obj)
+            check_order(scene, expected)
+        elif len(others) >= 3:
+            objs = rnd.sample(others, 3)
+            belows = scene.remove_many(objs)
+            for obj, below in zip(objs, belows):
+                index = expected.index(obj)
+                assert below is (expected[index - 1] if index else None)
+                expected.remove(obj)
+            unused.extend(objs)
+            check_order(scene, expected)
+    scene.extend(unused)
+    check_order(scene, expected + unused)